@@ -1,7 +1,22 @@
+import hashlib
+import os
+
 import streamlit as st
+import numpy as np
 import pandas as pd
 import streamlit_authenticator as stauth
 
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+from transactions import (
+    BATCH_ROWS, CSV_SCHEMA, MERCHANT_COL, NEEDED_COLS, SHARDS_DIR,
+    read_csv_batches, read_csv_chunks, read_csv_coerced_tables, shard_partitioning,
+)
+
 st.set_page_config(page_title="Merchant Portal", layout="wide")
 
 # =========================
@@ -20,27 +35,50 @@ st.set_page_config(page_title="Merchant Portal", layout="wide")
 # password_hash = "$2b$12$REPLACE"
 # merchant_id = "M002 - Merchant B"
 
-users_cfg = st.secrets.get("users", {})
-cookie_key = st.secrets.get("COOKIE_KEY", "change-me")
-
-creds = {"usernames": {}}
-for uname, u in users_cfg.items():
-    creds["usernames"][uname] = {
-        "name": u["name"],
-        "email": u["email"],
-        "password": u["password_hash"],
+# Snapshot the secrets instead of going through st.secrets each rerun. The TTL lets a
+# rotated password or remapped merchant take effect without a restart.
+@st.cache_resource(ttl=60)
+def load_config():
+    return {
+        "users": {u: dict(cfg) for u, cfg in st.secrets.get("users", {}).items()},
+        "cookie_key": st.secrets.get("COOKIE_KEY", "change-me"),
     }
 
+config = load_config()
+users_cfg = config["users"]
+cookie_key = config["cookie_key"]
+
+def build_credentials(users_cfg):
+    creds = {"usernames": {}}
+    for uname, u in users_cfg.items():
+        creds["usernames"][uname] = {
+            "name": u["name"],
+            "email": u["email"],
+            "password": u["password_hash"],
+        }
+    return creds
+
+# Build the credentials dict once per session and secrets snapshot, so an open login
+# form also picks up a rotated password. The Authenticate object itself is still
+# created every run: its constructor renders the cookie-manager component, and a
+# cached instance would never see the browser's cookies.
+if st.session_state.get("credentials_from") is not users_cfg:
+    st.session_state["credentials"] = build_credentials(users_cfg)
+    st.session_state["credentials_from"] = users_cfg
+
 # New API constructor (>=0.4.x)
 authenticator = stauth.Authenticate(
-    credentials=creds,
+    credentials=st.session_state["credentials"],
     cookie_name="merchant_portal",
     key=cookie_key,
     cookie_expiry_days=7,
+    auto_hash=False,  # Secrets already hold bcrypt hashes; skip the per-user hash pass
 )
 
 # New API: render login; do NOT unpack return values
-authenticator.login(location="main")
+# Once logged in there is nothing left for login() to do, so skip it on reruns
+if not st.session_state.get("authentication_status"):
+    authenticator.login(location="main")
 
 auth_status = st.session_state.get("authentication_status")
 name = st.session_state.get("name")
@@ -57,94 +95,283 @@ elif auth_status is None:
 authenticator.logout(location="sidebar")
 st.sidebar.write(f"Hello, **{name}**")
 
-try:
-    merchant_id = users_cfg[username]["merchant_id"]
-except KeyError:
+# username -> merchant_id, rebuilt on the same TTL as the secrets snapshot
+@st.cache_resource(ttl=60)
+def user_to_merchant():
+    return {u: cfg.get("merchant_id") for u, cfg in load_config()["users"].items()}
+
+merchant_id = user_to_merchant().get(username)
+if merchant_id is None:
     st.error("Merchant mapping not found for this user. Check Secrets configuration.")
     st.stop()
 
 # =========================
 # Load transactions CSV
 # =========================
-@st.cache_data(ttl=60)
-def load_transactions():
+def find_transactions_csv():
     # Try root, then /data
     for p in ("sample_merchant_transactions.csv", "data/sample_merchant_transactions.csv"):
-        try:
-            df = pd.read_csv(p)
-            df["__path__"] = p
-            return df
-        except Exception:
-            pass
+        if os.path.exists(p):
+            return p
     raise FileNotFoundError("CSV not found. Place it at repo root or in /data/")
 
-tx = load_transactions()
+def csv_header(csv_path):
+    return pd.read_csv(csv_path, nrows=0).columns
+
+def write_parquet(path, batches):
+    with pq.ParquetWriter(path, CSV_SCHEMA, compression="zstd", use_dictionary=True) as writer:
+        for batch in batches:
+            writer.write(batch, row_group_size=BATCH_ROWS)
+
+def csv_to_parquet(csv_path):
+    # One-shot conversion, redone only when the CSV is newer than its Parquet sibling.
+    # Streamed batch by batch, so the whole CSV is never in memory at once.
+    pq_path = os.path.splitext(csv_path)[0] + ".parquet"
+    if os.path.exists(pq_path) and os.path.getmtime(pq_path) >= os.path.getmtime(csv_path):
+        return pq_path
+    tmp_path = pq_path + ".tmp"
+    try:
+        write_parquet(tmp_path, read_csv_batches(csv_path))
+    except pa.ArrowInvalid:
+        # Malformed dates/amounts: start over through the coercing reader
+        write_parquet(tmp_path, read_csv_coerced_tables(csv_path))
+    os.replace(tmp_path, pq_path)
+    return pq_path
+
+def transaction_batches(csv_path):
+    # Raw rows as pandas frames, BATCH_ROWS at a time
+    if pa is None:
+        yield from read_csv_chunks(csv_path)
+        return
+    try:
+        pq_path = csv_to_parquet(csv_path)
+    except OSError:
+        # Read-only checkout: stream the CSV itself
+        yield from read_csv_chunks(csv_path)
+        return
+    with pq.ParquetFile(pq_path, read_dictionary=[MERCHANT_COL]) as pf:
+        for batch in pf.iter_batches(batch_size=BATCH_ROWS, columns=NEEDED_COLS):
+            yield batch.to_pandas()
+
+def read_merchant_shard(csv_path, merchant_id):
+    # None when there are no shards or the CSV has changed since they were written
+    if pa is None or not os.path.isdir(SHARDS_DIR):
+        return None
+    if os.path.getmtime(SHARDS_DIR) < os.path.getmtime(csv_path):
+        return None
+    # Prune columns in the reader too, so extra columns in the shards are never decoded
+    table = pq.read_table(SHARDS_DIR, columns=NEEDED_COLS, partitioning=shard_partitioning(),
+                          filters=[(MERCHANT_COL, "==", merchant_id)])
+    df = table.to_pandas()
+    df[MERCHANT_COL] = df[MERCHANT_COL].astype("category")
+    return df
+
+def merchant_offsets(per_day):
+    # Rows are grouped by merchant, so each merchant is one contiguous block
+    codes = per_day.index.codes[0]
+    if len(codes) == 0:
+        return {}
+    starts = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]])
+    ends = np.r_[starts[1:], len(codes)]
+    merchants = per_day.index.levels[0][codes[starts]]
+    return {m: (lo, hi) for m, lo, hi in zip(merchants, starts.tolist(), ends.tolist())}
+
+def daily_totals(tx):
+    # Group on datetime64 day buckets (int64 in C) rather than boxed Python dates;
+    # NaT keys are dropped by the groupby and the result comes back sorted
+    day = tx["Transaction Date"].dt.floor("D")
+    return (
+        tx
+        .groupby([tx[MERCHANT_COL], day], observed=True, sort=True)
+        .agg(revenue=("Settle Amount", "sum"),
+             orders=("Settle Amount", "count"))
+    )
+
+def daily_totals_batched(batches):
+    # Reduce each batch to (merchant, day) totals before concatenating, so only one
+    # batch of raw rows is in memory at a time. A merchant-day can straddle batches,
+    # so the partial totals are summed again.
+    parts = [daily_totals(tx).reset_index() for tx in batches]
+    if not parts:
+        return daily_totals(pd.DataFrame({
+            MERCHANT_COL: pd.Categorical([]),
+            "Transaction Date": pd.Series([], dtype="datetime64[s]"),
+            "Settle Amount": pd.Series([], dtype="float64"),
+        }))
+    # Each batch has its own categories; union them into one sorted set for the whole
+    # file rather than letting concat fall back to a column of Python strings
+    merchants = pd.api.types.union_categoricals(
+        [p.pop(MERCHANT_COL) for p in parts], sort_categories=True
+    )
+    per_day = pd.concat(parts, ignore_index=True)
+    per_day[MERCHANT_COL] = merchants
+    return per_day.groupby([MERCHANT_COL, "Transaction Date"], observed=True, sort=True).sum()
+
+# One (merchant, day) roll-up of the whole file per CSV version; sessions then
+# just slice their merchant's block. Only this small roll-up stays cached, not the
+# raw rows. cache_resource hands every rerun the same object, so treat it as read-only.
+# csv_mtime and rollup_version only feed the cache key, so a changed CSV or changed
+# code gets a fresh roll-up.
+@st.cache_resource(max_entries=1)
+def all_daily(csv_path, csv_mtime, rollup_version):
+    per_day = daily_totals_batched(transaction_batches(csv_path))
+    return per_day, merchant_offsets(per_day)
+
+# Checked once per CSV version rather than re-reading the header every rerun
+@st.cache_data(max_entries=1)
+def missing_columns(csv_path, csv_mtime):
+    return set(NEEDED_COLS) - set(csv_header(csv_path))
 
 # Validate required columns
-needed = {"Merchant Number - Business Name", "Transaction Date", "Settle Amount"}
-missing = needed - set(tx.columns)
+tx_path = find_transactions_csv()
+tx_mtime = os.path.getmtime(tx_path)
+missing = missing_columns(tx_path, tx_mtime)
 if missing:
     st.error(f"Missing required column(s) in CSV: {', '.join(sorted(missing))}")
     st.stop()
 
-# Parse/clean
-tx["Merchant Number - Business Name"] = tx["Merchant Number - Business Name"].astype(str).str.strip()
-tx["Transaction Date"] = pd.to_datetime(tx["Transaction Date"], errors="coerce")
-tx["Settle Amount"] = pd.to_numeric(tx["Settle Amount"], errors="coerce")
-
-# Filter to this merchant (Secrets merchant_id must match CSV)
-merchant_tx = tx[tx["Merchant Number - Business Name"] == merchant_id].copy()
-if merchant_tx.empty:
-    st.warning(f"No transactions found for merchant: {merchant_id}")
-    st.stop()
-
 
 # =========================
-# Aggregate: daily revenue/orders/AOV
+# Aggregate: daily revenue/orders
 # =========================
-daily = (
-    merchant_tx
-    .groupby(merchant_tx["Transaction Date"].dt.date, dropna=False)
-    .agg(revenue=("Settle Amount", "sum"),
-         orders=("Settle Amount", "count"))
-    .reset_index()
-    .rename(columns={"Transaction Date": "date"})
-)
-daily["date"] = pd.to_datetime(daily["date"], errors="coerce")
-daily = daily.dropna(subset=["date"]).sort_values("date")
-daily["aov"] = (daily["revenue"] / daily["orders"]).where(daily["orders"] > 0)
+def with_prefix_sums(daily):
+    # Running totals turn any date-range total into two endpoint lookups
+    return daily.assign(rev_cumsum=daily["revenue"].cumsum(), ord_cumsum=daily["orders"].cumsum())
+
+def rollup_version():
+    # Streamlit keys cached entries on compute_daily's own source only, so hash all
+    # the code behind the daily frames; a deploy that changes the readers or
+    # daily_totals must not keep serving pickles built by the old code
+    h = hashlib.sha256()
+    for path in (__file__, os.path.join(os.path.dirname(__file__), "transactions.py")):
+        with open(path, "rb") as f:
+            h.update(f.read())
+    return h.hexdigest()[:16]
+
+ROLLUP_VERSION = rollup_version()
+
+# Persisted to disk so restarts skip the CSV entirely for merchants seen before;
+# max_entries only bounds the in-memory LRU. Keying on the mtime and code version
+# replaces the TTL, which disk-persisted caches don't support, and
+# prune_daily_cache drops the pickles of older versions.
+@st.cache_data(persist="disk", max_entries=64)
+def compute_daily(merchant_id, csv_path, csv_mtime, rollup_version):
+    # Prefer this merchant's shard: O(merchant rows) instead of reading every merchant
+    tx = read_merchant_shard(csv_path, merchant_id)
+    if tx is not None:
+        return with_prefix_sums(daily_totals(tx).droplevel(0).rename_axis("date"))
+    per_day, offsets = all_daily(csv_path, csv_mtime, rollup_version)
+    if merchant_id not in offsets:
+        return pd.DataFrame(
+            columns=["revenue", "orders", "rev_cumsum", "ord_cumsum"],
+            index=pd.DatetimeIndex([], name="date"),
+        )
+    lo, hi = offsets[merchant_id]
+    # Sorted DatetimeIndex, so date-range filters downstream are O(log n) slices
+    return with_prefix_sums(per_day.iloc[lo:hi].droplevel(0).rename_axis("date"))
+
+# Once per CSV and code version per process. The version the disk cache was built
+# for is kept in a marker file, so a CSV replaced or code deployed while the app was
+# down is caught too.
+@st.cache_resource(max_entries=1)
+def prune_daily_cache(csv_path, csv_mtime, rollup_version):
+    marker = os.path.splitext(csv_path)[0] + ".cache-version"
+    version = f"{csv_mtime!r} {rollup_version}"
+    try:
+        with open(marker) as f:
+            last_version = f.read()
+    except OSError:
+        last_version = None
+    if last_version == version:
+        return
+    # Every persisted entry is for an older version and can never be hit again
+    compute_daily.clear()
+    try:
+        with open(marker, "w") as f:
+            f.write(version)
+    except OSError:
+        pass
+
+def aov(df):
+    # Derived on demand from the displayed rows rather than stored on the cached frame
+    return (df["revenue"] / df["orders"]).where(df["orders"] > 0)
+
+prune_daily_cache(tx_path, tx_mtime, ROLLUP_VERSION)
+daily = compute_daily(merchant_id, tx_path, tx_mtime, ROLLUP_VERSION)
+
+# Secrets merchant_id must match CSV
+if daily.empty:
+    st.warning(f"No transactions found for merchant: {merchant_id}")
+    st.stop()
 
 # =========================
 # Filters
 # =========================
-min_date = daily["date"].min().date()
-max_date = daily["date"].max().date()
-start_date, end_date = st.sidebar.date_input(
-    "Date range", value=(min_date, max_date),
-    min_value=min_date, max_value=max_date,
-)
-daily = daily[(daily["date"].dt.date >= start_date) & (daily["date"].dt.date <= end_date)]
+# daily is sorted by date, so the bounds are its first and last rows
+min_date = daily.index[0].date()
+max_date = daily.index[-1].date()
+# Picking dates inside a form doesn't rerun the page; the range only applies on submit
+with st.sidebar.form("date_filter"):
+    picked = st.date_input(
+        "Date range", value=(min_date, max_date),
+        min_value=min_date, max_value=max_date,
+    )
+    apply_range = st.form_submit_button("Apply range")
+# An applied range belongs to one merchant and one set of date bounds; start over at
+# the full range after a re-login as another merchant or when the CSV gains dates
+range_key = (merchant_id, min_date, max_date)
+if st.session_state.get("applied_range_key") != range_key:
+    st.session_state["applied_range_key"] = range_key
+    st.session_state["applied_range"] = (min_date, max_date)
+# A half-picked range has only a start date; keep the last applied range until both ends are set
+if apply_range and len(picked) == 2:
+    st.session_state["applied_range"] = tuple(picked)
+start_date, end_date = st.session_state["applied_range"]
+# Label slicing on the sorted, day-floored DatetimeIndex is a binary search
+daily = daily.loc[pd.Timestamp(start_date):pd.Timestamp(end_date)]
 
 # =========================
 # KPIs + Charts
 # =========================
 st.title("📊 Merchant Dashboard")
-st.caption(f"Merchant: **{merchant_id}**  |  Source: `{merchant_tx['__path__'].iat[0]}`")
+st.caption(f"Merchant: **{merchant_id}**  |  Source: `{tx_path}`")
 
-total_rev = float(daily["revenue"].sum()) if not daily.empty else 0.0
-total_orders = int(daily["orders"].sum()) if not daily.empty else 0
-aov_latest = daily["aov"].iloc[-1] if not daily.empty else None
+# Pull the columns out once as numpy views; the roll-up has no NaNs to skip
+rev_arr = daily["revenue"].to_numpy()
+ord_arr = daily["orders"].to_numpy()
+rev_cum = daily["rev_cumsum"].to_numpy()
+ord_cum = daily["ord_cumsum"].to_numpy()
+# Range total = running total at the last day minus the one just before the first,
+# so the KPIs cost the same for a week or for years
+if rev_arr.size:
+    total_rev = float(rev_cum[-1] - rev_cum[0] + rev_arr[0])
+    total_orders = int(ord_cum[-1] - ord_cum[0] + ord_arr[0])
+else:
+    total_rev, total_orders = 0.0, 0
+aov_latest = rev_arr[-1] / ord_arr[-1] if ord_arr.size and ord_arr[-1] > 0 else None
 
 k1, k2, k3 = st.columns(3)
 k1.metric("Total Revenue (Settle)", f"R {total_rev:,.0f}")
 k2.metric("Total Orders", f"{total_orders:,}")
 k3.metric("Latest AOV", f"R {aov_latest:,.2f}" if pd.notnull(aov_latest) else "—")
 
+CHART_MAX_POINTS = 2000
+
 st.subheader("Trends")
 if not daily.empty:
-    st.line_chart(daily.set_index("date")[["revenue", "orders"]])
+    # Long ranges are bucketed by week so the browser gets ~7x fewer points; AOV is
+    # then derived from the weekly sums
+    chart = daily[["revenue", "orders"]]
+    chart = chart.resample("W").sum() if len(chart) > CHART_MAX_POINTS else chart
+    # Charts only need display precision, so ship float32/int32 to halve the payload;
+    # KPIs and the table keep the float64 values
+    chart = chart.astype({"revenue": "float32", "orders": "int32"})
+    st.line_chart(chart, y=["revenue", "orders"])
     st.subheader("Average Order Value (AOV)")
-    st.bar_chart(daily.set_index("date")[["aov"]])
+    st.bar_chart(aov(chart).rename("aov"))
 
 st.subheader("Daily Aggregated Rows")
-st.dataframe(daily.reset_index(drop=True))
+# Only ship the most recent rows to the browser; the date index is shown as-is
+top_n = st.sidebar.number_input("Rows to preview", min_value=50, max_value=5000, value=365)
+rows = daily[["revenue", "orders"]].tail(top_n)
+st.dataframe(rows.assign(aov=aov(rows)))
@@ -0,0 +1,27 @@
+# Split the transactions CSV into one Parquet shard per merchant so the dashboard
+# only reads the logged-in merchant's rows. Re-run whenever the CSV changes; the
+# app ignores the shards once the CSV is newer.
+#
+#   python scripts/partition.py [path/to/transactions.csv]
+import os
+import shutil
+import sys
+
+import pyarrow.dataset as ds
+
+# Run from anywhere: the shared reader lives next to app.py
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from transactions import SHARDS_DIR, read_csv_table, shard_partitioning
+
+def partition(csv_path, out_dir=SHARDS_DIR):
+    table = read_csv_table(csv_path)
+
+    # Build next to the live shards, then swap, so the app never sees a half-written set
+    tmp_dir = out_dir + ".tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    ds.write_dataset(table, tmp_dir, format="parquet", partitioning=shard_partitioning())
+    shutil.rmtree(out_dir, ignore_errors=True)
+    os.replace(tmp_dir, out_dir)
+
+if __name__ == "__main__":
+    partition(sys.argv[1] if len(sys.argv) > 1 else "sample_merchant_transactions.csv")
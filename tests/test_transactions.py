@@ -0,0 +1,35 @@
+import pandas as pd
+import pytest
+
+from transactions import CSV_SCHEMA, MERCHANT_COL, read_csv_chunks, read_csv_table
+
+CSV = """\
+Merchant Number - Business Name,Transaction Date,Terminal ID,Settle Amount
+ M001 - Merchant A ,2025-07-01,T1,100
+M001 - Merchant A,notadate,T1,200
+,2025-07-02,T2,300
+M002 - Merchant B,2025-07-03,T3,400
+"""
+
+@pytest.fixture
+def malformed_csv(tmp_path):
+    # One bad date (forces the coercing reader) and one blank merchant cell
+    path = tmp_path / "transactions.csv"
+    path.write_text(CSV)
+    return str(path)
+
+def test_read_csv_chunks_coerces_bad_date_and_keeps_blank_merchant(malformed_csv):
+    df = pd.concat(read_csv_chunks(malformed_csv), ignore_index=True)
+    assert df[MERCHANT_COL].tolist()[:2] == ["M001 - Merchant A", "M001 - Merchant A"]
+    assert pd.isna(df.loc[2, MERCHANT_COL])
+    assert pd.isna(df.loc[1, "Transaction Date"])
+    assert df["Settle Amount"].tolist() == [100.0, 200.0, 300.0, 400.0]
+
+def test_read_csv_table_falls_back_to_typed_schema(malformed_csv):
+    pytest.importorskip("pyarrow")
+    table = read_csv_table(malformed_csv)
+    assert table.schema.equals(CSV_SCHEMA)
+    assert table[MERCHANT_COL].to_pylist() == [
+        "M001 - Merchant A", "M001 - Merchant A", None, "M002 - Merchant B",
+    ]
+    assert table["Transaction Date"].null_count == 1
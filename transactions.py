@@ -0,0 +1,90 @@
+# Reading the transactions CSV, shared by app.py and scripts/partition.py so the
+# dashboard and the shard builder agree on columns, types and malformed values.
+import os
+
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.csv as pacsv
+    import pyarrow.dataset as ds
+except ImportError:
+    pa = None
+
+MERCHANT_COL = "Merchant Number - Business Name"
+NEEDED_COLS = [MERCHANT_COL, "Transaction Date", "Settle Amount"]
+CSV_COLUMN_TYPES = {
+    MERCHANT_COL: pa.string(),
+    "Transaction Date": pa.timestamp("s"),
+    "Settle Amount": pa.float64(),
+} if pa is not None else {}
+CSV_SCHEMA = pa.schema(CSV_COLUMN_TYPES.items()) if pa is not None else None
+
+# Rows per batch when streaming the file instead of loading it whole
+BATCH_ROWS = 100_000
+
+# Per-merchant Parquet shards written by scripts/partition.py
+SHARDS_DIR = os.path.join("data", "by_merchant")
+
+def shard_partitioning():
+    # One hive-style merchant=<name> directory per merchant
+    return ds.partitioning(pa.schema([(MERCHANT_COL, pa.string())]), flavor="hive")
+
+def trim_merchant(batch):
+    i = NEEDED_COLS.index(MERCHANT_COL)
+    return batch.set_column(i, MERCHANT_COL, pc.utf8_trim_whitespace(batch[MERCHANT_COL]))
+
+def read_csv_chunks(csv_path):
+    # pandas reader, BATCH_ROWS at a time. Columns the C parser couldn't type because
+    # of malformed dates/amounts come back as text and are coerced to NaT/NaN here,
+    # at load, rather than failing the read.
+    with pd.read_csv(csv_path, usecols=NEEDED_COLS, dtype={MERCHANT_COL: "category"},
+                     parse_dates=["Transaction Date"], chunksize=BATCH_ROWS) as reader:
+        for df in reader:
+            # Strip once per distinct merchant rather than once per row
+            merchants = df[MERCHANT_COL].map(str.strip, na_action="ignore")
+            df[MERCHANT_COL] = merchants.astype("category")
+            if not pd.api.types.is_datetime64_any_dtype(df["Transaction Date"]):
+                df["Transaction Date"] = pd.to_datetime(df["Transaction Date"], errors="coerce")
+            if not pd.api.types.is_float_dtype(df["Settle Amount"]):
+                df["Settle Amount"] = pd.to_numeric(df["Settle Amount"], errors="coerce").astype("float64")
+            yield df
+
+def read_csv_coerced_tables(csv_path):
+    # read_csv_chunks as Arrow tables with the same column types as the typed read
+    for df in read_csv_chunks(csv_path):
+        yield pa.Table.from_pandas(df, schema=CSV_SCHEMA, preserve_index=False)
+
+def bytes_per_row(csv_path, sample_size=1 << 20):
+    # Average line length over the start of the file; exports vary from a handful of
+    # columns to dozens
+    with open(csv_path, "rb") as f:
+        sample = f.read(sample_size)
+    return max(len(sample) // max(sample.count(b"\n"), 1), 1)
+
+def read_csv_batches(csv_path):
+    # Arrow's streaming reader, typed up front so there's no inference pass. Raises
+    # ArrowInvalid on the first malformed value, possibly after some batches.
+    reader = pacsv.open_csv(
+        csv_path,
+        # Arrow blocks are sized in bytes; aim for about BATCH_ROWS rows each
+        read_options=pacsv.ReadOptions(block_size=BATCH_ROWS * bytes_per_row(csv_path)),
+        convert_options=pacsv.ConvertOptions(
+            column_types=CSV_COLUMN_TYPES,
+            include_columns=NEEDED_COLS,
+        ),
+    )
+    for batch in reader:
+        yield trim_merchant(batch)
+
+def read_csv_table(csv_path):
+    # Arrow's multi-threaded reader, typed up front so there's no inference pass
+    try:
+        table = pacsv.read_csv(csv_path, convert_options=pacsv.ConvertOptions(
+            column_types=CSV_COLUMN_TYPES,
+            include_columns=NEEDED_COLS,
+        ))
+    except pa.ArrowInvalid:
+        return pa.concat_tables(read_csv_coerced_tables(csv_path))
+    return trim_merchant(table)